@@ -19,7 +19,13 @@ __all__ = []
 __version__ = '0.8'
 __author__ = 'Kim Trønnes'
 
+import collections
+import concurrent.futures
+import functools
+import io
+import json
 import os
+import pathlib
 import urllib.request
 import shutil
 import zipfile
@@ -30,6 +36,10 @@ default_theme = 'bootstrap'
 mdwiki_filenames = ['mdwiki.html', 'mdwiki-slim.html', 'mdwiki-debug.html',
     'index.html', wiki_title+'.html']
 included_md_files = ['README.md', 'navigation.md','index.md']
+_MD_EXTS = ('.md',) # Todo: Add more supported markdown file endings.
+_DEFAULT_IGNORE = frozenset(included_md_files) | frozenset(mdwiki_filenames)
+# Folders never searched for .md-files. Hidden folders (.*) are skipped as well
+_SKIP_DIRS = frozenset(['node_modules', '__pycache__', 'venv', '.git', '.hg', '.svn'])
 url = 'https://github.com/Dynalon/mdwiki/releases/download/0.6.2/mdwiki-0.6.2.zip'
 
 banner = """
@@ -45,50 +55,43 @@ def create_config(title=None):
     """Create necessary file config.json"""
     if title is None:
         title = wiki_title
-    cfg = """{
-    "useSideMenu": true,
-    "lineBreaks": "gfm",
-    "additionalFooterText": "",
-    "anchorCharacter": "&#x2693;",
-    """
-    with open('config.json','w', encoding='utf8') as f:
-        f.write(cfg)
-        f.write('"title": "'+title+'"\n}')
+    cfg = {
+        'useSideMenu': True,
+        'lineBreaks': 'gfm',
+        'additionalFooterText': '',
+        'anchorCharacter': '&#x2693;',
+        'title': title,
+    }
+    content = json.dumps(cfg, ensure_ascii=False, indent=4)
+    pathlib.Path('config.json').write_text(content, encoding='utf8')
 
-def create_index(path, title=None, ignore=None):
+def create_index(path, title=None, ignore=None, tree=None):
     """Create index.md based on listed directories and files in dir.
 
     Separates pages (files) and categories (directories)
     Optionally omit listing files in ignore list
+    Uses the listing in tree (see scan_tree) if given, else scans path
     """
     if title is None:
         title = titlify(path)
-    if ignore is None:
-        ignore = []
-    dirlist = []
-    filelist = []
-    for f in os.listdir(path):
-        filepath = os.path.join(path,f)
-        if os.path.isdir(filepath) and is_md_dir(filepath, recursive=True) and f not in ignore:
-            dirlist.append(f)
-        if is_md_file(filepath) and f not in ignore:
-            filelist.append(f)    
-    with open(os.path.join(path,'index.md'), 'w', encoding='utf8') as fd:
-        fd.write('# '+title+'\n\n')
-        if dirlist:
-            if filelist:
-                fd.write('## Categories\n\n')
-            dirlist.sort()
-            for d in dirlist:
-                fd.write('- ['+titlify(d)+']('+d+'/index.md)\n')
-        if dirlist and filelist:
-            fd.write('\n## Pages\n\n')
+    ignore = frozenset(ignore) if ignore else frozenset()
+    if tree is None:
+        tree = scan_tree(path)
+    info = tree[path]
+    dirlist = [d for d in info.mddirs if d not in ignore]
+    filelist = [f for f in info.mdfiles if f not in ignore]
+    parts = ['# ', title, '\n\n']
+    if dirlist:
         if filelist:
-            filelist.sort()
-            for f in filelist:
-                base = os.path.basename(f)
-                ftitle = titlify(os.path.splitext(base)[0])            
-                fd.write('- ['+ftitle+']('+f+')\n')
+            parts.append('## Categories\n\n')
+        for d in dirlist:
+            parts.append(f'- [{titlify(d)}]({d}/index.md)\n')
+    if dirlist and filelist:
+        parts.append('\n## Pages\n\n')
+    for f in filelist:
+        ftitle = titlify(os.path.splitext(f)[0])
+        parts.append(f'- [{ftitle}]({f})\n')
+    pathlib.Path(path+os.sep+'index.md').write_text(''.join(parts), encoding='utf8')
 
 def create_navigation(navlist, title=None, theme=None):
     """Create necessary file navigation.md"""
@@ -96,33 +99,82 @@ def create_navigation(navlist, title=None, theme=None):
         title = wiki_title
     if theme is None:
         theme = default_theme
-    with open('navigation.md', 'w', encoding='utf8') as f:
-        f.write('# '+title+'\n\n')
-        for item in navlist:
-            f.write(item+'\n')
-        f.write('\n[gimmick:Theme (inverse: false)]('+theme+')\n')
-        f.write('[gimmick:ThemeChooser](Change theme)')
+    parts = ['# ', title, '\n\n']
+    for item in navlist:
+        parts.append(f'{item}\n')
+    parts.append(f'\n[gimmick:Theme (inverse: false)]({theme})\n')
+    parts.append('[gimmick:ThemeChooser](Change theme)')
+    pathlib.Path('navigation.md').write_text(''.join(parts), encoding='utf8')
     
-def is_md_file(path):
-    # Todo: Add more supported markdown file endings.
-    # Todo: Check if file is ascii/txt
-    return os.path.isfile(path) and path.endswith('.md')
-
-def is_md_dir(path, recursive=False):
-    """True if folder includes at least one .md-file. 
-    Recursive flag: searches subfolders and returns True at least one .md-file is found
+def _is_skipped(name):
+    return name.startswith('.') or name in _SKIP_DIRS
+
+# Listing of a directory: sorted .md-file names, sorted names of
+# subdirectories containing .md-files, whether the directory itself
+# contains any .md-files at any depth, and whether it was reached through
+# a symlinked folder
+DirInfo = collections.namedtuple('DirInfo', ['mdfiles', 'mddirs', 'has_md', 'linked'])
+
+def scan_tree(root):
+    """Scan root once and return a dict of {dirpath: DirInfo} for all folders
+
+    Symlinked folders are followed, except links back to a folder above them,
+    and everything below a link is marked as linked
     """
-    assert os.path.isdir(path), 'input is not a directory'
-    if recursive:
-        for root, dirs, files in os.walk(path):
-            for f in files:
-                if is_md_file(os.path.join(root,f)):
-                    return True
-    else:
-        for f in os.listdir(path):
-            if is_md_file(os.path.join(path,f)):
-                return True
-    return False
+    tree = {}
+    _scan_dir(root, tree, os.path.realpath(root), set(), False)
+    return tree
+
+def _scan_dir(path, tree, realpath, ancestors, linked):
+    try:
+        with os.scandir(path) as it:
+            entries = sorted(it, key=lambda e: e.name)
+    except OSError:
+        # Skip unreadable folders, like os.walk does
+        info = tree[path] = DirInfo([], [], False, linked)
+        return info
+    mdfiles = []
+    subdirs = []
+    for entry in entries:
+        if entry.is_dir():
+            if not _is_skipped(entry.name):
+                subdirs.append(entry)
+        elif entry.name.endswith(_MD_EXTS) and entry.is_file():
+            # Todo: Check if file is ascii/txt
+            mdfiles.append(entry.name)
+    mddirs = []
+    ancestors.add(realpath)
+    for e in subdirs:
+        if e.is_symlink():
+            real = os.path.realpath(e.path)
+            if real in ancestors:
+                # Link cycle
+                continue
+        else:
+            real = os.path.join(realpath, e.name)
+        if _scan_dir(e.path, tree, real, ancestors, linked or e.is_symlink()).has_md:
+            mddirs.append(e.name)
+    ancestors.discard(realpath)
+    info = DirInfo(mdfiles, mddirs, bool(mdfiles or mddirs), linked)
+    tree[path] = info
+    return info
+
+def walk_md_dirs(tree, root='.'):
+    """Yield (dirpath, name) of folders below root with .md-files, breadth first.
+
+    Follows only the md-folders listed in tree (see scan_tree), so
+    subtrees without .md-files are never visited. Symlinked folders are
+    yielded but not entered, like os.walk does by default
+    """
+    queue = collections.deque([root])
+    while queue:
+        path = queue.popleft()
+        prefix = path + os.sep
+        for d in tree[path].mddirs:
+            dirpath = prefix + d
+            if not tree[dirpath].linked:
+                queue.append(dirpath)
+            yield dirpath, d
 
 def input_bool(question):
     negative = ['n','0','f']
@@ -146,26 +198,32 @@ def input_string(question):
         else:
             return s
 
-def download(url, filename):
-    """Download file from URL. Save as filename"""
+def download(url):
+    """Download file from URL. Return contents as BytesIO, None on failure"""
     try:
-        response = urllib.request.urlopen(url)
-        with urllib.request.urlopen(url, timeout=10) as response, open(filename, 'wb') as outFile:
-            shutil.copyfileobj(response, outFile)
+        buf = io.BytesIO()
+        with urllib.request.urlopen(url, timeout=10) as response:
+            shutil.copyfileobj(response, buf, length=1<<20)
     except Exception as e:
         print(e)
+        return None
+    buf.seek(0)
+    return buf
 
 def list_md_files(dir, ignore=None):
     # Todo: Pass ignored files as argument
     if ignore is None:
-        ignore = included_md_files + mdwiki_filenames
-    files = os.listdir(dir)
+        ignore = _DEFAULT_IGNORE
+    else:
+        ignore = frozenset(ignore)
     mdfiles = []
-    for f in files:
-        if is_md_file(f) and f not in ignore:
-            mdfiles.append(f)
+    with os.scandir(dir) as it:
+        for entry in it:
+            if entry.name.endswith(_MD_EXTS) and entry.is_file() and entry.name not in ignore:
+                mdfiles.append(entry.name)
     return mdfiles
 
+@functools.lru_cache(maxsize=4096)
 def titlify(dir):
     """Make title from file/dir name"""
     return dir.title().replace('_',' ')
@@ -178,80 +236,102 @@ def infoprint(msg):
 def main(): 
     print(banner)
 
+    # Files present in root folder, listed once for the checks below
+    with os.scandir('.') as it:
+        present = {e.name for e in it if e.is_file()}
+
     # Check if mdwiki html files exists
-    mdwikiExists = False   
-    for f in mdwiki_filenames:
-        if os.path.isfile(f):
-            mdwikiExists = True
+    mdwikiExists = not present.isdisjoint(mdwiki_filenames)
     if not mdwikiExists:
-        zipName = 'mdwiki.zip'       
-        if not os.path.isfile(zipName):
+        zipName = 'mdwiki.zip'
+        fromDisk = zipName in present
+        if fromDisk:
+            zipSource = zipName
+        else:
             print('Warning: MDWiki html file not found. Fetching files from repository...')
-            download(url,zipName)
+            zipSource = download(url)
+            if zipSource is None:
+                return
+
+        # Zip from Github holds 'mdwiki-[version]/mdwiki.html'. Extract only that file
+        with zipfile.ZipFile(zipSource,'r') as z:
+            member = next(n for n in z.namelist() if n.endswith('/mdwiki.html'))
+            with z.open(member) as src, open('index.html','wb') as dst:
+                shutil.copyfileobj(src, dst)
+        if fromDisk:
+            os.remove(zipName)
+
+    # Phase 1: Scan all folders once
+    tree = scan_tree('.')
+    createNav = 'navigation.md' not in present
+
+    # Phase 2: Collect nav panel candidates and folders lacking index.md
+    navDirs = []
+    indexTasks = {} # {realpath: (dirpath, name, title)}
+    rootFiles = []
+    if createNav:
+        for dirpath, d in walk_md_dirs(tree):
+            title = titlify(d)
+
+            # For all dirs in root folder, ask to add to nav panel
+            if dirpath.count(os.sep) == 1:
+                navDirs.append((d, title))
+
+            # Index files use the titles from here, user defined titles later
+            # A folder reachable through a symlink too is written only once,
+            # preferably under its own name
+            if 'index.md' not in tree[dirpath].mdfiles:
+                real = os.path.realpath(dirpath)
+                if real not in indexTasks or tree[indexTasks[real][0]].linked:
+                    indexTasks[real] = (dirpath, d, title) # Todo: add ignored files 
 
-        # Unzip files from Github. Ends up in 'tmp/mdwiki-[version]/mdwiki.html'
-        with zipfile.ZipFile(zipName,'r') as z:
-            z.extractall('tmp')      
-        unzippedDir = os.listdir('tmp')[0]        
-        assert isinstance(unzippedDir,str), 'Unexpected file type in folder tmp'
-        shutil.move(os.path.join('tmp',unzippedDir,'mdwiki.html'),'index.html')
+            # Todo: Add logic for adding level 2 directories to Nav panel
+            # if depth == 2 and parent(d) in level2List: # use split(os.sep) to find parent
 
-        # Delete leftover files
-        shutil.rmtree('tmp')
-        os.remove(zipName)
+        rootFiles = list_md_files('.') # Check if ignored files are added
+
+    # Phase 3: Ask all questions before anything is written
+    writeBuffer = []
+    for d, title in navDirs:
+        if input_bool('Add directory '+d+' as Menu item in Nav panel?'):
+            # if not input_bool('Is name "'+title+'" OK?'):
+            #    title = input_string('Enter name')
+            writeBuffer.append('['+title+']('+d+'/index.md)')
+            # if input_bool('Add directories in '+d+' to Nav panel as drop down?'):
+            #    level2List.append(d)
+            #    # Store the level 1 dir that wants level 2 dirs as drop down in list
+    # Todo: Check if writebuffer is sorted for directories
+    for f in rootFiles:
+        if input_bool('Add '+f+' as Link in Nav panel?'):
+            title = os.path.splitext(f)[0].title()
+            if not input_bool('Is name "'+title+'" OK?'):
+                title = input_string('Enter name')
+            writeBuffer.append('['+title+']('+f+')')
 
+    # Phase 4: Write files
     # Check if index.md exists
-    if not os.path.isfile('index.md'):
+    if 'index.md' not in present:
         infoprint('Creating root index file.')
-        create_index('.',wiki_title, included_md_files)
+        create_index('.',wiki_title, included_md_files, tree)
 
     # Check if config.json exists
-    if not os.path.isfile('config.json'):
+    if 'config.json' not in present:
         infoprint('Creating default config file. Please review settings.')
         create_config()
-    
-    # Create navigation file
-    if not os.path.isfile('navigation.md'):
-        writeBuffer = []
-        for root, alldirs, files in os.walk('.'):
-            for d in alldirs:                
-                dirpath = os.path.join(root,d)
-                if not is_md_dir(dirpath, recursive=True):
-                    # ignore all folders without md files
-                    continue
-                depth = len(dirpath.split(os.sep))-1
-                title = titlify(d)
-                dirfiles = os.listdir(dirpath)
-
-                # For all dirs in root folder, ask to add to nav panel
-                if depth == 1:
-                    if input_bool('Add directory '+d+' as Menu item in Nav panel?'):
-                        # if not input_bool('Is name "'+title+'" OK?'):
-                        #    title = input_string('Enter name')
-                        writeBuffer.append('['+title+']('+d+'/index.md)')
-                        # if input_bool('Add directories in '+d+' to Nav panel as drop down?'):
-                        #    level2List.append(d)
-                        #    # Store the level 1 dir that wants level 2 dirs as drop down in list
-
-                # Create index.md after depth checks to include user defined titles
-                if not os.path.isfile(os.path.join(root,d,'index.md')):
-                    infoprint('Creating index file in '+d)
-                    create_index(dirpath, title) # Todo: add ignored files 
-
-                # Todo: Check if writebuffer is sorted for directories            
-                
-                # Todo: Add logic for adding level 2 directories to Nav panel
-                # if depth == 2 and parent(d) in level2List: # use split(os.sep) to find parent
 
-        rootFiles = list_md_files('.') # Check if ignored files are added
-        for f in rootFiles:
-            if input_bool('Add '+f+' as Link in Nav panel?'):
-                title = os.path.splitext(f)[0].title()
-                if not input_bool('Is name "'+title+'" OK?'):
-                    title = input_string('Enter name')
-                writeBuffer.append('['+title+']('+f+')')
+    # Index files are independent of each other, write them in parallel
+    if indexTasks:
+        workers = min(8, (os.cpu_count() or 1)*2)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as ex:
+            futures = [(d, ex.submit(create_index, p, t, tree=tree)) for p, d, t in indexTasks.values()]
+        for d, future in futures:
+            future.result()
+            infoprint('Created index file in '+d)
+
+    # Create navigation file
+    if createNav:
         infoprint('Creating navigation file.')
-        create_navigation(writeBuffer)  
+        create_navigation(writeBuffer)
 
 if __name__ == '__main__':
 	main()
\ No newline at end of file